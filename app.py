@@ -3,6 +3,8 @@ import pandas as pd
 from sqlalchemy import create_engine
 from langchain_openai import ChatOpenAI
 from langchain_community.utilities.sql_database import SQLDatabase
+from langchain_core.messages import SystemMessage, HumanMessage
+import hashlib
 import re
 import os
 import io
@@ -35,62 +37,33 @@ def get_db_and_engine():
 
 db, engine = get_db_and_engine()
 
+# Refreshed periodically so tables created or altered by the ETL show up without a restart.
+@st.cache_resource(ttl=600)
+def get_schema(_db):
+    return _db.get_table_info()
+
 @st.cache_resource
 def setup_llm():
     return ChatOpenAI(model="gpt-3.5-turbo", openai_api_key=OPENAI_API_KEY, temperature=0)
 
 llm = setup_llm()
 
-# --- 3. Core Logic Functions ---
-def polish_text_output(text: str) -> str:
-    """Programmatically fixes common text formatting errors from the LLM."""
-    if not text: return ""
-    text = re.sub(r',([a-zA-Z])', r', \1', text)
-    text = re.sub(r'\.([a-zA-Z])', r'. \1', text)
-    text = re.sub(r'(\d)([a-zA-Z])', r'\1 \2', text)
-    return text
-
-def run_orchestrated_analysis(user_question: str, db_object, db_engine) -> (pd.DataFrame, str):
-    """This master function orchestrates the entire AI analysis process."""
-    schema = db_object.get_table_info()
-    planning_prompt = f"""
+# --- 3. Prompts ---
+# Static instructions go in the system message so every request shares the same
+# prefix and can hit OpenAI's automatic prompt cache; only the user message varies.
+PLANNING_SYSTEM = """
 You are a world-class data analyst AI. Your task is to generate a JSON object with a plan.
-USER QUESTION: "{user_question}"
-DATABASE SCHEMA: <schema>{schema}</schema>
+You will be given the DATABASE SCHEMA followed by a USER QUESTION.
 Follow this process:
 1.  **Thought Process:** Think step-by-step.
 2.  **SQL Query:** Write a SQL query. CRITICAL SQL RULE: When aggregating data over time, you MUST `SELECT` and `GROUP BY` all relevant time periods (like year and month).
 3.  **Pandas Code:** If needed, write pandas code for final analysis on `df`. The result must be in `result_df`. If not needed, return an empty string.
 Provide a JSON object with keys: "thought_process", "sql_query", "pandas_code".
 """
-    try:
-        response = llm.invoke(planning_prompt)
-        plan_str = re.search(r"```json\n(.*?)\n```", response.content, re.DOTALL)
-        plan_dict = json.loads(plan_str.group(1) if plan_str else response.content)
-        sql_query = plan_dict.get("sql_query")
-        pandas_code = plan_dict.get("pandas_code")
-        thought_process = plan_dict.get("thought_process", "Analysis complete.")
-        if not sql_query: return None, "The AI planner failed to generate a valid SQL query."
-
-        with st.expander("Show AI's Execution Plan"):
-            st.write(thought_process)
-            st.code(sql_query, language="sql")
-            if pandas_code: st.code(pandas_code, language="python")
 
-        df = pd.read_sql_query(sql_query, db_engine)
-        if pandas_code:
-            exec_scope = {"df": df.copy(), "pd": pd}
-            exec(pandas_code, exec_scope)
-            final_df = exec_scope.get("result_df", exec_scope["df"])
-        else:
-            final_df = df
-        if isinstance(final_df.index, pd.DatetimeIndex): final_df = final_df.reset_index()
-
-        summary_prompt = f"""
+SUMMARY_SYSTEM = """
 You are a senior data analyst writing a final summary for a business report.
-The user asked the following question: "{user_question}".
-You have already performed the analysis, and the final data is in the following summary table:
-{final_df.to_markdown()}
+You will be given the user's question. You have already performed the analysis, and the final data is in the summary table provided with it.
 
 **YOUR TASK:**
 Write an insightful, user-friendly summary of the findings based on the data.
@@ -100,19 +73,123 @@ Write an insightful, user-friendly summary of the findings based on the data.
 2.  **SPACING:** You MUST ensure there is a space after every single word, comma, and period. Check your output for "mergedwords". For example, an output like "sales were 100,and then..." is WRONG. The correct format is "sales were 100, and then...". An output like "thedata is..." is WRONG. The correct format is "the data is...".
 3.  **CONTENT:** Explain what the data means. Do not just list the numbers from the table. Provide brief insights.
 
-Begin the summary now.
+Begin the summary once you receive the question and table.
 """
-        unpolished_answer = llm.invoke(summary_prompt).content
-        final_answer = polish_text_output(unpolished_answer)
+# The summary prompt carries no schema, so it gets its own fixed cache key rather than the planner's schema hash.
+SUMMARY_CACHE_KEY = hashlib.sha256(SUMMARY_SYSTEM.encode()).hexdigest()
+
+# --- 4. Core Logic Functions ---
+# A comma, period or digit directly followed by a letter is missing a space.
+_MISSING_SPACE = re.compile(r'([,.\d])([a-zA-Z])')
+_JSON_DECODER = json.JSONDecoder()
+
+def polish_text_output(text: str) -> str:
+    """Programmatically fixes common text formatting errors from the LLM."""
+    if not text: return ""
+    return _MISSING_SPACE.sub(r'\1 \2', text)
+
+def _summarize_df_for_llm(df: pd.DataFrame) -> str:
+    """Serializes a head+tail sample plus column stats, bounded in rows and columns, so large results don't blow the token budget."""
+    # Keep a meaningful index (e.g. groupby keys from pandas_code); only a default RangeIndex carries no labels.
+    keep_index = not isinstance(df.index, pd.RangeIndex)
+    if len(df) <= 20: return df.to_csv(index=keep_index)
+    # Head and tail: results are usually time series sorted oldest-first, so the latest periods must be included.
+    sample = df.head(10).to_csv(index=keep_index) + f"... {len(df) - 20} rows omitted ...\n" + df.tail(10).to_csv(index=keep_index, header=False)
+    # Stats are capped by column too, so a wide result can't blow the budget through describe().
+    stats = df.iloc[:, :20].describe(include='all').to_csv()
+    if df.shape[1] > 20: stats += f"... stats for {df.shape[1] - 20} more columns omitted ...\n"
+    return sample + "\n\nSTATS:\n" + stats
+
+def _extract_json(text: str) -> dict:
+    """Decodes the plan object (the first JSON object with a "sql_query" key) in an LLM response, preferring a ```json fence."""
+    _, fence, fenced = text.partition("```json")
+    body = fenced.partition("```")[0] if fence else text
+    start = body.find('{')
+    while start != -1:
+        try:
+            # Braces or stray JSON in prose (e.g. "{}") decode fine but are not the plan, so keep scanning past them.
+            value = _JSON_DECODER.raw_decode(body, start)[0]
+            if isinstance(value, dict) and "sql_query" in value: return value
+        except json.JSONDecodeError:
+            pass
+        start = body.find('{', start + 1)
+    raise ValueError("The AI planner did not return a JSON plan with a sql_query.")
+
+@st.cache_resource(max_entries=256)
+def _compile_generated(source: str):
+    """Compiles LLM-generated code once; repeat snippets reuse the code object across reruns."""
+    return compile(source, "<generated>", "exec")
+
+@st.cache_data(ttl=3600, max_entries=256)
+def _plan(user_question: str, schema: str) -> dict:
+    """Asks the LLM for an execution plan. Cached so repeat questions skip the API call."""
+    schema_key = hashlib.sha256(schema.encode()).hexdigest()
+    planning_messages = [
+        SystemMessage(content=PLANNING_SYSTEM),
+        # Schema before question: the schema is stable across questions, so it extends the cached prefix.
+        HumanMessage(content=f'DATABASE SCHEMA: <schema>{schema}</schema>\nUSER QUESTION: "{user_question}"'),
+    ]
+    response = llm.invoke(planning_messages, prompt_cache_key=schema_key)
+    return _extract_json(response.content)
+
+def run_orchestrated_analysis(user_question: str, db_object, db_engine) -> (pd.DataFrame, str):
+    """This master function orchestrates the entire AI analysis process."""
+    schema = get_schema(db_object)
+    insights = None
+    try:
+        plan_dict = _plan(user_question, schema)
+        sql_query = plan_dict.get("sql_query")
+        pandas_code = plan_dict.get("pandas_code")
+        thought_process = plan_dict.get("thought_process", "Analysis complete.")
+        if not sql_query:
+            _plan.clear(user_question, schema)
+            return None, "The AI planner failed to generate a valid SQL query."
+
+        with st.expander("Show AI's Execution Plan"):
+            st.write(thought_process)
+            st.code(sql_query, language="sql")
+            if pandas_code: st.code(pandas_code, language="python")
+
+        try:
+            df = pd.read_sql_query(sql_query, db_engine)
+            if pandas_code:
+                exec_scope = {"df": df.copy(), "pd": pd}
+                exec(_compile_generated(pandas_code), exec_scope)
+                final_df = exec_scope.get("result_df", exec_scope["df"])
+            else:
+                final_df = df
+        except Exception:
+            # Forget a plan whose SQL or pandas code fails so a retry asks the LLM again instead of replaying it.
+            _plan.clear(user_question, schema)
+            raise
+        if isinstance(final_df.index, pd.DatetimeIndex): final_df = final_df.reset_index()
+
+        summary_messages = [
+            SystemMessage(content=SUMMARY_SYSTEM),
+            HumanMessage(content=f'The user asked the following question: "{user_question}".\nSUMMARY TABLE:\n{_summarize_df_for_llm(final_df)}'),
+        ]
+        # Heading and streamed text share one slot so a failed stream can be cleared as a unit.
+        insights = st.empty()
+        with insights.container():
+            st.subheader("💡 Key Insights")
+            placeholder = st.empty()
+        chunks = []
+        for chunk in llm.stream(summary_messages, prompt_cache_key=SUMMARY_CACHE_KEY):
+            chunks.append(chunk.content)
+            placeholder.markdown("".join(chunks))
+        final_answer = polish_text_output("".join(chunks))
+        placeholder.markdown(final_answer)
         return final_df, final_answer
     except Exception as e:
+        if insights is not None: insights.empty()
         return None, f"An error occurred during analysis: {e}"
 
 def polish_dataframe_for_display(df: pd.DataFrame) -> pd.DataFrame:
     """Prepares the final DataFrame for perfect visualization."""
     if df is None: return None
+    date_cols = df.select_dtypes(include=['datetime', 'datetimetz']).columns
+    if len(date_cols): return df.sort_values(by=date_cols[0]).reset_index(drop=True)
     df = df.copy()
-    date_col = None
     if 'year' in df.columns and 'month' in df.columns:
         try:
             df['date'] = pd.to_datetime(df['year'].astype(str) + '-' + df['month'].astype(str) + '-01')
@@ -120,7 +197,8 @@ def polish_dataframe_for_display(df: pd.DataFrame) -> pd.DataFrame:
             return df
         except Exception: pass
     for col in df.columns:
-        if 'date' in col.lower():
+        # Only object/text columns (e.g. Postgres DATE values) can hold unparsed dates.
+        if 'date' in str(col).lower() and pd.api.types.is_string_dtype(df[col].dtype):
             try:
                 df[col] = pd.to_datetime(df[col])
                 df = df.sort_values(by=col).reset_index(drop=True)
@@ -128,10 +206,10 @@ def polish_dataframe_for_display(df: pd.DataFrame) -> pd.DataFrame:
             except Exception: pass
     return df
 
-def get_visualization_code(df: pd.DataFrame, user_question: str) -> str:
-    """Generates beautiful, presentation-ready, and contextually appropriate Plotly code."""
-    if df is None: return ""
-    df_summary = f"The DataFrame has columns named {df.columns.to_list()} with data types {df.dtypes.to_dict()}."
+@st.cache_data(ttl=3600, max_entries=256)
+def _viz_code(user_question: str, columns: tuple, dtypes: tuple) -> str:
+    """Asks the LLM for Plotly code. Cached on the question plus the DataFrame's column names and dtypes."""
+    df_summary = f"The DataFrame has columns named {list(columns)} with data types {dict(zip(columns, dtypes))}."
     prompt = f"""
 You are a data visualization expert specializing in Plotly Express. Your task is to write a single block of Python code to create the most appropriate chart for the user's question, using the provided DataFrame `df`.
 USER QUESTION: "{user_question}"
@@ -145,14 +223,23 @@ CRITICAL RULES:
 - You MUST use the exact column names from the DataFrame Summary.
 - DO NOT include `import` statements or sample data.
 """
+    response = llm.invoke(prompt)
+    _, fence, code = response.content.partition("```python")
+    return code.partition("```")[0].strip() if fence else response.content.strip()
+
+def _viz_cache_args(df: pd.DataFrame, user_question: str) -> tuple:
+    """The _viz_code arguments for df, shared by the lookup and the eviction of a snippet that fails to render."""
+    return user_question, tuple(df.columns), tuple(df.dtypes.astype(str))
+
+def get_visualization_code(df: pd.DataFrame, user_question: str) -> str:
+    """Generates beautiful, presentation-ready, and contextually appropriate Plotly code."""
+    if df is None: return ""
     try:
-        response = llm.invoke(prompt)
-        cleaned_code = re.search(r"```python\n(.*?)\n```", response.content, re.DOTALL)
-        return cleaned_code.group(1).strip() if cleaned_code else response.content.strip()
+        return _viz_code(*_viz_cache_args(df, user_question))
     except Exception:
         return ""
 
-# --- 4. Streamlit User Interface ---
+# --- 5. Streamlit User Interface ---
 user_question = st.text_input("Your Question:", placeholder="e.g., 'What is the 3 month rolling average for sales?'")
 
 if st.button("Generate Insight"):
@@ -161,9 +248,11 @@ if st.button("Generate Insight"):
     else:
         final_df, text_answer = run_orchestrated_analysis(user_question, db, engine)
 
-        st.subheader("💡 Key Insights")
+        if final_df is None:
+            # Successful answers are already streamed in place by run_orchestrated_analysis.
+            st.subheader("💡 Key Insights")
+            if text_answer: st.markdown(text_answer)
         if text_answer:
-            st.markdown(text_answer)
             st.divider()
         
         if final_df is not None and not final_df.empty:
@@ -175,11 +264,12 @@ if st.button("Generate Insight"):
                 if viz_code:
                     try:
                         exec_scope = {"df": polished_df, "pd": pd, "px": px}
-                        exec(viz_code, exec_scope)
+                        exec(_compile_generated(viz_code), exec_scope)
                         fig = exec_scope.get("fig")
                         if fig:
                             st.plotly_chart(fig, use_container_width=True)
                     except Exception as e:
+                        _viz_code.clear(*_viz_cache_args(polished_df, user_question))
                         st.error(f"An error occurred while rendering the visualization: {e}")
             else:
                 st.info("A chart was not generated because the result is a single data point.")
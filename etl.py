@@ -1,41 +1,60 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import datetime as dt
 from sqlalchemy import create_engine
 import psycopg
 import os
+import io
+import csv
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Data loading
-df = pd.read_csv(r'e-commerce-shopping-dataset.csv', parse_dates=['order_date'])
+df = pd.read_csv(r'e-commerce-shopping-dataset.csv',
+                 engine='pyarrow',
+                 dtype_backend='pyarrow',
+                 # The PyArrow engine reads ISO dates as date32; pin the timestamp type so order_date stays a TIMESTAMP column.
+                 dtype={'order_date': 'timestamp[ns][pyarrow]', 'payment_method': 'category', 'delivery_status': 'category'})
 
 # Schema Setup
-fct_order_line_items = df.copy()
+fct_order_line_items = df
 
-fct_order_line_items['location'] = fct_order_line_items['city'] + ', ' + fct_order_line_items['state'] + ' ' + fct_order_line_items['zipcode']
+city, state, zipcode = (pc.cast(pa.array(fct_order_line_items[c].array), pa.string()) for c in ('city', 'state', 'zipcode'))
+fct_order_line_items['location'] = pd.arrays.ArrowExtensionArray(pc.binary_join_element_wise(city, ', ', state, ' ', zipcode, ''))
 
+uniques = {}
 for column in ['payment_method', 'delivery_status', 'order_date', 'location']:
-    fct_order_line_items[column + '_id'] = fct_order_line_items[column].astype('category').cat.codes + 1
+    codes, uniques[column] = pd.factorize(fct_order_line_items[column], sort=True)
+    fct_order_line_items[column + '_id'] = codes + 1
+
+def dim_from_uniques(column):
+    """Builds a (<column>_id, <column>) dimension from the sorted factorize uniques; ids match the fact table's codes."""
+    values = uniques[column]
+    return pd.DataFrame({column + '_id': np.arange(1, len(values) + 1), column: values})
 
 dim_product = fct_order_line_items[['product_id', 'product_category', 'product_price']]
-dim_payment_method = fct_order_line_items[['payment_method_id','payment_method']].drop_duplicates().dropna().sort_values(by='payment_method_id')
-dim_delivery_status = fct_order_line_items[['delivery_status_id','delivery_status']].drop_duplicates().dropna().sort_values(by='delivery_status_id')
+dim_payment_method = dim_from_uniques('payment_method')
+dim_delivery_status = dim_from_uniques('delivery_status')
 dim_customer = df[['customer_id']]
-dim_location = df[['location_id', 'city', 'state', 'zipcode']].drop_duplicates().dropna().reset_index(drop=True).sort_values(by='zipcode')
+dim_location = fct_order_line_items[fct_order_line_items['location_id'] > 0].groupby('location_id', as_index=False)[['city', 'state', 'zipcode']].first()
 
-dim_date = fct_order_line_items[['order_date_id', 'order_date']].drop_duplicates().dropna().reset_index(drop=True).sort_values(by='order_date')
+dim_date = dim_from_uniques('order_date')
 dim_date['year'] = dim_date['order_date'].dt.year
 dim_date['month'] = dim_date['order_date'].dt.month
 dim_date['day'] = dim_date['order_date'].dt.day
 dim_date['day_name'] = dim_date['order_date'].dt.day_name()
 dim_date['day_of_week'] = dim_date['order_date'].dt.dayofweek
 dim_date['day_of_year'] = dim_date['order_date'].dt.dayofyear
-dim_date['weekday'] = dim_date['order_date'].dt.weekday
+dim_date['weekday'] = dim_date['day_of_week']
 dim_date['quarter'] = dim_date['order_date'].dt.quarter
-dim_date['year_month'] = dim_date['order_date'].dt.strftime('%Y-%m')
-dim_date['year_week'] = dim_date['order_date'].dt.strftime('%Y-%W')
-dim_date.sort_values(by='order_date_id', inplace=True)
+# Same values as strftime('%Y-%m') / strftime('%Y-%W') (Monday-based week number), built without per-element strftime.
+year = dim_date['year'].astype(str)
+dim_date['year_month'] = year + '-' + dim_date['month'].astype(str).str.zfill(2)
+dim_date['year_week'] = year + '-' + ((dim_date['day_of_year'] + 6 - dim_date['day_of_week']) // 7).astype(str).str.zfill(2)
 
 fct_order_line_items.drop(columns=['payment_method', 'delivery_status', 'product_category', 'product_price', 'city', 'state', 'zipcode', 'order_date'], inplace=True)
-fct_order_line_items = fct_order_line_items[['order_id', 'customer_id', 'product_id', 'location_id', 'discount_applied', 'quantity', 'order_value', 'order_date_id', 'payment_method_id', 'delivery_status_id', 'review_rating', 'return_requested' ]]
+fct_order_line_items = fct_order_line_items[['order_id', 'customer_id', 'product_id', 'location_id', 'discount_applied', 'quantity', 'order_value', 'order_date_id', 'payment_method_id', 'delivery_status_id', 'review_rating', 'return_requested']]
 
 # Database connection setup
 DB_USER = os.getenv('DB_USER')
@@ -45,25 +64,46 @@ DB_PORT = os.getenv('DB_PORT')
 DB_NAME = os.getenv('DB_NAME')
 
 db_connection_str = f'postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-db_connection = create_engine(db_connection_str)
+db_connection = create_engine(db_connection_str, pool_size=4)
+
+def psql_insert_copy(table, conn, keys, data_iter):
+    """to_sql insertion method that streams rows through PostgreSQL COPY instead of INSERTs."""
+    buf = io.StringIO()
+    csv.writer(buf).writerows(data_iter)
+    buf.seek(0)
+    columns = ', '.join(f'"{k}"' for k in keys)
+    table_name = f'{table.schema}.{table.name}' if table.schema else table.name
+    with conn.connection.cursor() as cur, cur.copy(f'COPY {table_name} ({columns}) FROM STDIN WITH CSV') as copy:
+        while chunk := buf.read(1 << 20):
+            copy.write(chunk)
+
+def bulk(df, name):
+    """Appends df to table `name` via COPY, in 10k-row batches so the CSV buffer stays bounded."""
+    with db_connection.begin() as conn:
+        df.to_sql(name, conn, if_exists='append', index=False, method=psql_insert_copy, chunksize=10_000)
 
 # Loading data into the database
 try:
     print("Connecting to the database...")
-    print("Loading dim_date...")
-    dim_date.to_sql('dim_date', db_connection, if_exists='append', index=False)
-    print("Loading dim_customer...")
-    dim_customer.to_sql('dim_customer', db_connection, if_exists='append', index=False)
-    print("Loading dim_product...")
-    dim_product.to_sql('dim_product', db_connection, if_exists='append', index=False)
-    print("Loading dim_location...")
-    dim_location.to_sql('dim_location', db_connection, if_exists='append', index=False)
-    print("Loading dim_payment_method...")
-    dim_payment_method.to_sql('dim_payment_method', db_connection, if_exists='append', index=False)
-    print("Loading dim_delivery_status...")
-    dim_delivery_status.to_sql('dim_delivery_status', db_connection, if_exists='append', index=False)
+    # Dimensions are independent, so load them concurrently on separate pooled connections;
+    # the fact table references them and goes last.
+    dims = {
+        'dim_date': dim_date,
+        'dim_customer': dim_customer,
+        'dim_product': dim_product,
+        'dim_location': dim_location,
+        'dim_payment_method': dim_payment_method,
+        'dim_delivery_status': dim_delivery_status,
+    }
+    print(f"Loading dimensions: {', '.join(dims)}...")
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = {executor.submit(bulk, frame, name): name for name, frame in dims.items()}
+        # Progress is printed from the main thread as each load finishes; prints from the workers would interleave.
+        for future in as_completed(futures):
+            future.result()
+            print(f"Loaded {futures[future]}.")
     print("Loading fct_order_line_items...")
-    fct_order_line_items.to_sql('fct_order_line_items', db_connection, if_exists='append', index=False)
+    bulk(fct_order_line_items, 'fct_order_line_items')
     print("Data loading complete!")
 
 except Exception as e: